@@ -9,28 +9,98 @@ Output: defs.json    (mappa JSON { parola: definizione })
 Uso:
   python build_defs.py --input words.json --output defs.json
   python build_defs.py -i words.json -o defs.json --append   # aggiorna senza perdere voci già presenti
+  python build_defs.py -i words.json -o defs.json --cache ""  # disabilita la cache SQLite delle risposte
+
+Ogni risposta viene accodata subito a defs.jsonl (una riga { parola: definizione }),
+defs.json viene scritto solo alla fine, dopodiché defs.jsonl viene cancellato; se la run
+si interrompe, con --append si riparte anche da defs.jsonl.
 """
 
-import argparse, json, re, time, html, sys, unicodedata
+import argparse, asyncio, hashlib, json, math, os, re, sqlite3, time, html, sys, unicodedata
 from pathlib import Path
-from typing import Optional, Dict
-import requests
-from requests.adapters import HTTPAdapter, Retry
+from typing import Optional, Dict, List, NamedTuple, Tuple, Union
+from urllib.parse import quote, urlencode, urlparse
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
 from tqdm import tqdm
 import random
 
+try:
+    import brotli  # noqa: F401  (httpx decodifica 'br' solo se il modulo è installato)
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
 WIKTIONARY_API = "https://it.wiktionary.org/w/api.php"
 WIKIPEDIA_SUMMARY = "https://it.wikipedia.org/api/rest_v1/page/summary/{}"
 
 UA = "EreditaGame/1.0"
 
+# le risposte in cache valgono 30 giorni
+CACHE_TTL = 86400 * 30
+# commit su disco ogni N risposte salvate (e comunque alla chiusura)
+CACHE_COMMIT_EVERY = 100
+
+# dopo un 429 le richieste verso lo stesso host ricevono un po' di jitter per questi secondi
+THROTTLE_WINDOW = 10
+# tetto (secondi) all'attesa chiesta dal server con Retry-After
+MAX_RETRY_AFTER = 60
+
+# MediaWiki accetta al più 50 titoli per richiesta (utenti non-bot)
+WIKTIONARY_BATCH = 50
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+# sentinella: la pagina Wiktionary non esiste (diverso da None = pagina senza definizione utile)
+MISSING = _Missing()
+
+# ---------- regex (compilate una volta sola) ----------
+
+_RE_WS = re.compile(r"\s+", re.UNICODE)
+# markup wiki in un'unica alternanza: <ref>…</ref>, tag HTML, template {{...}}, link [[...]], ''' e ''
+_RE_MARKUP = re.compile(
+    r"(?P<ref><ref[^>]*>.*?</ref>)"
+    r"|(?P<tag></?(?:nowiki|ref|math|code|span|div|br|small|i|b|u|sup|sub)[^>]*>)"
+    r"|(?P<tpl>\{\{[^{}]*\}\})"
+    r"|\[\[(?P<link>[^\[\]]+)\]\]"
+    r"|'''|''",
+    re.DOTALL | re.IGNORECASE,
+)
+_RE_PAREN = re.compile(r"^\((?:[^()]{1,120})\)\s*")
+_RE_SENT = re.compile(r"(.+?[.!?])(\s|$)")
+# riga di definizione "# ...", non esempi/citazioni/sottodefinizioni ('#:' '#*' '##')
+_RE_DEFLINE = re.compile(r"^#(?![:*#])\s*(.+)")
+_RE_SEC_IT = re.compile(r"==\s*Italiano\s*==(?P<body>.*?)(?:\n==[^=].*?==|\Z)", re.DOTALL | re.IGNORECASE)
+_RE_POST1 = re.compile(r"^(In\s+\w+istica,\s*)", re.IGNORECASE)
+_RE_POST2 = re.compile(r"^\b(E|È|E')\b\s+", re.IGNORECASE)
+# lemma plausibile: solo lettere (anche accentate), apostrofo, trattino e spazio
+_RE_VALID = re.compile(r"[A-Za-zÀ-ÖØ-öø-ÿ'’\- ]{2,40}")
+
 # ---------- util ----------
 
 def normalize_space(s: str) -> str:
     s = html.unescape(s)
-    s = re.sub(r"\s+", " ", s, flags=re.UNICODE).strip()
+    s = _RE_WS.sub(" ", s).strip()
     return s
 
+def _repl_markup(m) -> str:
+    kind = m.lastgroup
+    if kind == "link":
+        # link [[target|label]] o [[target]]: un solo scan, senza '"|" in' + split
+        body = m.group("link")
+        _, sep, label = body.partition("|")
+        if not sep:
+            label = body
+        # il label può contenere altro markup (corsivi, tag, template): ripulisci anche quello
+        return _RE_MARKUP.sub(_repl_markup, label)
+    if kind in ("tag", "tpl"):
+        return " "
+    # <ref>…</ref> e corsivi/grassetti wiki
+    return ""
+
 def strip_markup(text: str) -> str:
     """
     Pulisce wikitext semplice:
@@ -39,24 +109,12 @@ def strip_markup(text: str) -> str:
       - leva '' corsivi/grassetti
       - rimuove <ref>...</ref> e tag HTML
     """
-    # togli <ref> e altri tag
-    text = re.sub(r"<ref[^>]*>.*?</ref>", "", text, flags=re.DOTALL)
-    text = re.sub(r"</?(nowiki|ref|math|code|span|div|br|small|i|b|u|sup|sub)[^>]*>", " ", text, flags=re.IGNORECASE)
-    # template {{...}} (greedy bilanciato semplice)
-    text = re.sub(r"\{\{[^{}]*\}\}", " ", text)
-    # link [[target|label]] o [[target]]
-    def _repl_link(m):
-        body = m.group(1)
-        if "|" in body:
-            return body.split("|", 1)[1]
-        return body
-    text = re.sub(r"\[\[([^\[\]]+)\]\]", _repl_link, text)
-    # corsivi/grassetti wiki
-    text = text.replace("'''", "").replace("''", "")
+    # un solo passaggio sul testo: ogni match viene sostituito in base al suo tipo
+    text = _RE_MARKUP.sub(_repl_markup, text)
     # entità HTML e spazi
     text = normalize_space(text)
     # rimuovi parentesi iniziali troppo enciclopediche
-    text = re.sub(r"^\((?:[^()]{1,120})\)\s*", "", text)
+    text = _RE_PAREN.sub("", text)
     return text
 
 def first_sentence(s: str, min_len: int = 20) -> str:
@@ -65,97 +123,220 @@ def first_sentence(s: str, min_len: int = 20) -> str:
     """
     s = normalize_space(s)
     # taglia a fine prima frase
-    m = re.search(r"(.+?[.!?])(\s|$)", s)
+    m = _RE_SENT.search(s)
     if m and len(m.group(1)) >= min_len:
         return m.group(1)
     return s
 
+def save_json(data, path: Path):
+    # scrittura atomica: un'interruzione a metà non lascia mai un file troncato
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, path)
+
+def read_jsonl(path: Path) -> Dict[str, str]:
+    # lettura riga per riga; un'ultima riga troncata (run interrotta) viene ignorata
+    data: Dict[str, str] = {}
+    with path.open("rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                data.update(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                continue
+    return data
+
+def ends_with_newline(path: Path) -> bool:
+    # un file vuoto conta come terminato: non serve separare nulla
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
 def target_is_italian_section(title: str) -> bool:
-    # euristica: accetta tutto; potresti filtrare caratteri non-lettera se vuoi
-    return True
+    # euristica: cifre, punteggiatura o titoli troppo lunghi non hanno una voce da cercare
+    return _RE_VALID.fullmatch(title) is not None
+
+def definition_from_wikitext(wikitext: str) -> Optional[str]:
+    """
+    Isola la sezione 'Italiano' e prende la prima riga di definizione che inizia con '# '
+    (escludi '#:' '#*' che sono esempi/citazioni).
+    """
+    # isola sezione Italiano
+    m = _RE_SEC_IT.search(wikitext)
+    body = m.group("body") if m else wikitext  # fallback: tutto il testo
+    # cerca prima definizione "# ..." (senza materializzare la lista delle righe)
+    for ln in body.splitlines():
+        m = _RE_DEFLINE.match(ln.lstrip())
+        if not m:
+            continue
+        cand = first_sentence(strip_markup(m.group(1)))
+        if len(cand) >= 12:
+            return cand
+    return None
 
 # ---------- fetchers ----------
 
-class Http:
-    def __init__(self, rate_per_sec=3):
-        self.delay = 1.0 / max(rate_per_sec, 1)
-        self.last = 0.0
-        self.s = requests.Session()
-        retries = Retry(
-            total=5,
-            backoff_factor=0.6,  # base backoff
-            status_forcelist=(429, 500, 502, 503, 504),
-            allowed_methods=frozenset(["GET"])
+class Resp(NamedTuple):
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+
+    def json(self):
+        # orjson lavora direttamente sui bytes: niente decode -> str -> json.loads
+        return orjson.loads(self.content)
+
+class ResponseCache:
+    """
+    Cache persistente (SQLite) delle risposte HTTP: le riesecuzioni leggono da disco
+    invece di rifare le stesse richieste.
+    """
+    def __init__(self, path: Path, ttl: int = CACHE_TTL, commit_every: int = CACHE_COMMIT_EVERY):
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self.pending = 0
+        self.db = sqlite3.connect(str(path))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, status INT, headers TEXT, body BLOB, ts INT)"
         )
-        self.s.headers.update({"User-Agent": "EreditaGame/1.0 (you@example.com)"})
-        self.s.mount("https://", HTTPAdapter(max_retries=retries))
-
-    def get(self, url, **kwargs):
-        # rate limit + jitter
-        now = time.time()
-        wait = self.delay - (now - self.last)
-        if wait > 0:
-            time.sleep(wait + random.uniform(0.1, 0.3))
-        self.last = time.time()
-        r = self.s.get(url, timeout=30, **kwargs)
-
-        # Rispetta Retry-After manualmente se presente
-        if r.status_code in (429, 503):
-            ra = r.headers.get("Retry-After")
-            if ra:
-                try:
-                    time.sleep(int(ra))
-                except:
-                    time.sleep(2)
-        return r
-
-def fetch_wiktionary_definition(http: Http, term: str) -> Optional[str]:
+        self.db.commit()
+
+    @staticmethod
+    def key(method: str, url: str, params=None, data=None) -> str:
+        raw = "\n".join([
+            method,
+            url,
+            urlencode(sorted((params or {}).items())),
+            urlencode(sorted((data or {}).items())),
+        ])
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+    def get(self, key: str) -> Optional[Resp]:
+        row = self.db.execute(
+            "SELECT status, headers, body FROM cache WHERE key = ? AND ts >= ?",
+            (key, int(time.time()) - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        return Resp(row[0], json.loads(row[1]), row[2])
+
+    def set(self, key: str, resp: Resp):
+        self.db.execute(
+            "INSERT OR REPLACE INTO cache (key, status, headers, body, ts) VALUES (?, ?, ?, ?, ?)",
+            (key, resp.status_code, json.dumps(resp.headers), resp.content, int(time.time())),
+        )
+        # il commit (fsync) blocca l'event loop: lo si fa a blocchi, non per ogni risposta
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+class Http:
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, session: httpx.AsyncClient, rate_per_sec=3, retries=5, backoff_factor=0.6,
+                 backoff_jitter=0.3, cache: Optional[ResponseCache] = None):
+        self.rate = max(rate_per_sec, 1)
+        # token bucket per host: Wiktionary e Wikipedia hanno quote indipendenti
+        self.limiters: Dict[str, AsyncLimiter] = {}
+        self.throttled_until: Dict[str, float] = {}
+        self.s = session
+        self.retries = retries
+        self.backoff_factor = backoff_factor  # base backoff
+        self.backoff_jitter = backoff_jitter
+        self.cache = cache
+
+    def _limiter(self, host: str) -> AsyncLimiter:
+        if host not in self.limiters:
+            self.limiters[host] = AsyncLimiter(self.rate, 1)
+        return self.limiters[host]
+
+    def _backoff(self, attempt: int, resp: Optional[Resp] = None) -> float:
+        # Retry-After (429/503) ha la precedenza sul backoff esponenziale
+        ra = resp.headers.get("retry-after") if resp is not None else None
+        if ra:
+            try:
+                wait = float(ra)
+            except ValueError:
+                pass  # formato data HTTP: usa il backoff
+            else:
+                # valori enormi, inf o nan non devono fermare un worker all'infinito
+                return MAX_RETRY_AFTER if math.isnan(wait) else min(max(wait, 0.0), MAX_RETRY_AFTER)
+        return self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_jitter)
+
+    async def request(self, method: str, url, use_cache: bool = True, **kwargs) -> Resp:
+        # cache hit: nessuna richiesta, quindi niente rate limit
+        key = None
+        if self.cache is not None and use_cache:
+            key = ResponseCache.key(method, str(url), kwargs.get("params"), kwargs.get("data"))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        host = urlparse(str(url)).netloc
+        for attempt in range(self.retries + 1):
+            # jitter solo se l'host ci ha appena risposto 429, altrimenti basta il token bucket
+            if time.monotonic() < self.throttled_until.get(host, 0.0):
+                await asyncio.sleep(random.uniform(0.1, 0.3))
+            try:
+                async with self._limiter(host):
+                    r = await self.s.request(method, url, **kwargs)
+                resp = Resp(r.status_code, dict(r.headers), r.content)  # httpx: chiavi header minuscole
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if resp.status_code == 429:
+                self.throttled_until[host] = time.monotonic() + THROTTLE_WINDOW
+            if resp.status_code in self.RETRY_STATUS and attempt < self.retries:
+                await asyncio.sleep(self._backoff(attempt, resp))
+                continue
+            break
+
+        if key is not None and resp.status_code < 500 and resp.status_code != 429:
+            self.cache.set(key, resp)
+        return resp
+
+    async def get(self, url, **kwargs) -> Resp:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs) -> Resp:
+        return await self.request("POST", url, **kwargs)
+
+async def fetch_wiktionary_definition(http: Http, term: str) -> Union[str, _Missing, None]:
     """
     Strategia:
-      1) action=parse + wikitext -> isola sezione 'Italiano' -> prendi la prima riga di definizione che inizia con '# '
-         (escludi '#:' '#*' che sono esempi/citazioni)
-      2) se fallisce, usa action=query&prop=extracts (plain) e prova a estrarre la prima frase utile
+      1) action=query&prop=extracts con exintro/exsentences (plain): la pulizia del markup
+         la fa già MediaWiki, scarta le intestazioni '=' e tieni la prima frase utile
+      2) se l'estratto è vuoto, action=parse + wikitext -> isola sezione 'Italiano' -> prendi
+         la prima riga di definizione che inizia con '# ' (escludi '#:' '#*' che sono esempi/citazioni)
+    Se la pagina non esiste ritorna MISSING senza altre richieste.
     """
     params = {
-        "action": "parse",
-        "format": "json",
-        "prop": "wikitext|sections",
-        "redirects": 1,
-        "page": term
-    }
-    r = http.get(WIKTIONARY_API, params=params)
-    if r.status_code == 200:
-        data = r.json()
-        if "error" not in data and "parse" in data:
-            wikitext = data["parse"].get("wikitext", {}).get("*", "")
-            if wikitext:
-                # isola sezione Italiano
-                sec_re = re.compile(r"==\s*Italiano\s*==(?P<body>.*?)(?:\n==[^=].*?==|\Z)", re.DOTALL | re.IGNORECASE)
-                m = sec_re.search(wikitext)
-                body = m.group("body") if m else wikitext  # fallback: tutto il testo
-                # cerca prima definizione "# ..."
-                lines = [ln.strip() for ln in body.splitlines()]
-                for ln in lines:
-                    if ln.startswith("#") and not ln.startswith(("#:", "#*", "##")):
-                        cand = ln.lstrip("#").strip()
-                        cand = strip_markup(cand)
-                        cand = first_sentence(cand)
-                        if len(cand) >= 12:
-                            return cand
-
-    # fallback: extracts plaintext
-    params2 = {
         "action": "query",
         "format": "json",
         "prop": "extracts",
+        "exintro": 1,
+        "exsentences": 2,
         "explaintext": 1,
         "redirects": 1,
         "titles": term
     }
-    r2 = http.get(WIKTIONARY_API, params=params2)
-    if r2.status_code == 200:
-        data = r2.json()
+    r = await http.get(WIKTIONARY_API, params=params)
+    if r.status_code == 200:
+        data = r.json()
         pages = data.get("query", {}).get("pages", {})
+        if pages and all("missing" in pg for pg in pages.values()):
+            return MISSING
         for _, pg in pages.items():
             ext = pg.get("extract")
             if ext:
@@ -166,11 +347,102 @@ def fetch_wiktionary_definition(http: Http, term: str) -> Optional[str]:
                     cand = normalize_space(cand)
                     if len(cand) >= 12:
                         return cand
+
+    # fallback: wikitext completo
+    params2 = {
+        "action": "parse",
+        "format": "json",
+        "prop": "wikitext",
+        "redirects": 1,
+        "page": term
+    }
+    r2 = await http.get(WIKTIONARY_API, params=params2)
+    if r2.status_code == 200:
+        data = r2.json()
+        if "error" not in data and "parse" in data:
+            wikitext = data["parse"].get("wikitext", {}).get("*", "")
+            if wikitext:
+                return definition_from_wikitext(wikitext)
     return None
 
-def fetch_wikipedia_summary(http: Http, term: str) -> Optional[str]:
-    url = WIKIPEDIA_SUMMARY.format(requests.utils.quote(term.replace(" ", "_")))
-    r = http.get(url, headers={"Accept": "application/json"})
+def _wiktionary_page_key(term: str) -> str:
+    # voce di cache per singola parola: non dipende da come le parole finiscono nei batch
+    return ResponseCache.key("PAGE", WIKTIONARY_API, {"titles": term})
+
+def _page_result(page: dict) -> Union[str, _Missing, None]:
+    if page.get("missing"):
+        return MISSING
+    wikitext = page.get("wikitext", "")
+    return definition_from_wikitext(wikitext) if wikitext else None
+
+def cached_wiktionary_batch(http: Http, terms: List[str]) -> Dict[str, Union[str, _Missing, None]]:
+    """
+    Risolve dalla cache (per pagina) i termini già scaricati da un batch precedente,
+    con lo stesso formato di ritorno di fetch_wiktionary_batch.
+    """
+    found: Dict[str, Union[str, _Missing, None]] = {}
+    if http.cache is None:
+        return found
+    for term in terms:
+        cached = http.cache.get(_wiktionary_page_key(term))
+        if cached is not None:
+            found[term] = _page_result(cached.json())
+    return found
+
+async def fetch_wiktionary_batch(http: Http, terms: List[str]) -> Dict[str, Union[str, _Missing, None]]:
+    """
+    Come fetch_wiktionary_definition, ma per molte parole insieme: una sola POST
+    action=query&prop=revisions&titles=a|b|c… ogni WIKTIONARY_BATCH termini, poi
+    demultiplexa le pagine in locale (seguendo 'normalized' e 'redirects').
+    Ritorna i termini con una definizione, con valore MISSING quelli senza pagina e con
+    valore None quelli la cui pagina esiste ma non contiene una definizione utile.
+    Mancano solo i termini di cui il batch non ha restituito il contenuto.
+    La cache è per pagina (vedi cached_wiktionary_batch), non per POST: cambiare la
+    lista di parole sposta i confini dei blocchi e non deve invalidare tutto.
+    """
+    found: Dict[str, Union[str, _Missing, None]] = {}
+    for i in range(0, len(terms), WIKTIONARY_BATCH):
+        chunk = terms[i:i + WIKTIONARY_BATCH]
+        data = {
+            "action": "query",
+            "format": "json",
+            "prop": "revisions",
+            "rvprop": "content",
+            "rvslots": "main",
+            "redirects": 1,
+            "titles": "|".join(chunk)
+        }
+        r = await http.post(WIKTIONARY_API, data=data, use_cache=False)
+        if r.status_code != 200:
+            continue
+        query = r.json().get("query", {})
+
+        # titolo finale della pagina -> termini originali che vi puntano
+        origin: Dict[str, List[str]] = {t: [t] for t in chunk}
+        for key in ("normalized", "redirects"):
+            for m in query.get(key, []):
+                origin.setdefault(m["to"], []).extend(origin.pop(m["from"], []))
+
+        for _, pg in query.get("pages", {}).items():
+            if "missing" in pg:
+                page = {"missing": True}
+            else:
+                revs = pg.get("revisions")
+                if not revs:
+                    continue  # contenuto non restituito
+                page = {"wikitext": revs[0].get("slots", {}).get("main", {}).get("*", "")}
+            # il wikitext c'è già tutto: rifarne il parse per singola parola non servirebbe
+            result = _page_result(page)
+            for term in origin.get(pg.get("title"), []):
+                found[term] = result
+                if http.cache is not None:
+                    http.cache.set(_wiktionary_page_key(term), Resp(200, {}, orjson.dumps(page)))
+    return found
+
+async def fetch_wikipedia_summary(http: Http, term: str) -> Optional[str]:
+    # safe="": anche '/' va codificato, altrimenti finisce nel path della REST API
+    url = WIKIPEDIA_SUMMARY.format(quote(term.replace(" ", "_"), safe=""))
+    r = await http.get(url, headers={"Accept": "application/json"})
     if r.status_code == 200:
         data = r.json()
         # ignora pagine di disambiguazione
@@ -185,12 +457,38 @@ def fetch_wikipedia_summary(http: Http, term: str) -> Optional[str]:
 
 # ---------- pipeline ----------
 
-def build_defs(words_path: Path, out_path: Path, append: bool = False, save_every: int = 50) -> Dict[str, str]:
-    http = Http(rate_per_sec=4)
+def postfix_definition(definition: str) -> str:
+    # rimuovi “In linguistica,”, “È un/una …” troppo ridondante (soft)
+    definition = _RE_POST1.sub("", definition)
+    definition = _RE_POST2.sub("", definition)
+    return normalize_space(definition)
+
+async def process_word(http: Http, term: str, wiktionary_missing: bool = False) -> Tuple[str, Optional[str]]:
+    # 1) Wiktionary (saltato se il batch ha già detto che la pagina non esiste)
+    definition = MISSING if wiktionary_missing else await fetch_wiktionary_definition(http, term)
+
+    # 2) Wikipedia (fallback) solo se la pagina Wiktionary non esiste, non quando esiste
+    # ma non se ne ricava una definizione: niente seconda richiesta nel caso comune
+    if definition is MISSING:
+        definition = await fetch_wikipedia_summary(http, term)
+
+    # 3) Post-fix
+    if definition:
+        definition = postfix_definition(definition)
+    return term, definition
+
+async def _build_defs_async(words_path: Path, out_path: Path, append: bool = False,
+                            concurrency: int = 16, cache_path: Optional[Path] = None) -> Dict[str, str]:
     words = json.loads(words_path.read_text(encoding="utf-8"))
 
     if not isinstance(words, list):
         raise ValueError("words.json deve contenere un array JSON di stringhe.")
+    if concurrency < 1:
+        # con 0 il semaforo non si libererebbe mai e la run resterebbe appesa
+        raise ValueError("concurrency deve essere almeno 1.")
+
+    # deduplica (mantiene l'ordine): ogni parola genera al più una serie di richieste
+    words = list(dict.fromkeys(w.strip() for w in words if isinstance(w, str) and w.strip()))
 
     existing: Dict[str, str] = {}
     if append and out_path.exists():
@@ -199,69 +497,128 @@ def build_defs(words_path: Path, out_path: Path, append: bool = False, save_ever
         except Exception:
             existing = {}
 
-    out: Dict[str, str] = dict(existing)
+    jsonl_path = out_path.with_suffix(".jsonl")
+    if append and jsonl_path.exists():
+        existing.update(read_jsonl(jsonl_path))
 
-    pbar = tqdm(words, desc="Fetching", unit="word")
-    updated = 0
+    out: Dict[str, str] = dict(existing)
 
-    for idx, raw in enumerate(pbar):
-        if not raw or not isinstance(raw, str):
-            continue
-        term = raw.strip()
+    todo = []
+    for term in words:
         if term in out and out[term]:
             continue  # già presente
 
-        # Normalizza forma base (senza alterare il lemma)
+        # scarta subito le parole che non possono avere una voce (nessuna richiesta HTTP)
         if not target_is_italian_section(term):
-            continue
-
-        # 1) Wiktionary
-        definition = fetch_wiktionary_definition(http, term)
-
-        # 2) Wikipedia (fallback)
-        if not definition:
-            definition = fetch_wikipedia_summary(http, term)
-
-        # 3) Post-fix: rimuovi “In linguistica,”, “È un/una …” troppo ridondante (soft)
-        if definition:
-            definition = re.sub(r"^(In\s+\w+istica,\s*)", "", definition, flags=re.IGNORECASE)
-            definition = re.sub(r"^\b(E|È|E')\b\s+", "", definition, flags=re.IGNORECASE)
-            definition = normalize_space(definition)
-
-        if definition:
-            out[term] = definition
-            updated += 1
-        else:
-            # salva placeholder vuoto (o salta: qui manteniamo esplicito)
             out[term] = ""
-
-        # salvataggio incrementale
-        if save_every and (idx + 1) % save_every == 0:
-            out_path.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
-
-    # salvataggio finale
-    out_path.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+            continue
+        todo.append(term)
+
+    # HTTP/2: tutte le richieste verso it.wiktionary.org e it.wikipedia.org viaggiano
+    # multiplexate su una connessione per host (niente handshake TLS ripetuti)
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=concurrency, keepalive_expiry=60)
+    # niente retries sul transport: l'unico livello di retry è Http.request
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits)
+    headers = {
+        "User-Agent": "EreditaGame/1.0 (you@example.com)",
+        "Accept-Encoding": ACCEPT_ENCODING,
+    }
+    cache = ResponseCache(cache_path) if cache_path else None
+    try:
+        async with httpx.AsyncClient(transport=transport, timeout=30, headers=headers) as session:
+            http = Http(session, rate_per_sec=4, cache=cache)
+            sem = asyncio.Semaphore(concurrency)
+
+            # 0) Wiktionary in blocchi da WIKTIONARY_BATCH titoli
+            async def bounded_batch(chunk: List[str]):
+                async with sem:
+                    return await fetch_wiktionary_batch(http, chunk)
+
+            # in batch solo le parole non ancora in cache, impacchettate in blocchi pieni
+            hits = cached_wiktionary_batch(http, todo)
+            uncached = [t for t in todo if t not in hits]
+            chunks = [uncached[i:i + WIKTIONARY_BATCH] for i in range(0, len(uncached), WIKTIONARY_BATCH)]
+            for found in await asyncio.gather(*[bounded_batch(c) for c in chunks]):
+                hits.update(found)
+
+            async def bounded(term: str):
+                hit = hits.get(term)
+                if isinstance(hit, str):
+                    return term, postfix_definition(hit)
+                if term in hits and hit is None:
+                    return term, None  # pagina esistente senza definizione: niente fallback
+                # pagina singola solo per le parole di cui il batch non ha restituito il contenuto
+                async with sem:
+                    return await process_word(http, term, wiktionary_missing=hit is MISSING)
+
+            pbar = tqdm(total=len(todo), desc="Fetching", unit="word")
+            updated = 0
+
+            # salvataggio incrementale: una riga per parola, O(len(definizione)) a scrittura
+            with jsonl_path.open("ab" if append else "wb") as journal:
+                # ultima riga troncata (kill -9, corrente): va chiusa, altrimenti il primo
+                # record nuovo le si incolla dietro e read_jsonl scarterebbe anche quello
+                if append and not ends_with_newline(jsonl_path):
+                    journal.write(b"\n")
+                for fut in asyncio.as_completed([bounded(t) for t in todo]):
+                    term, definition = await fut
+                    pbar.update(1)
+
+                    if definition:
+                        out[term] = definition
+                        updated += 1
+                    else:
+                        # salva placeholder vuoto (o salta: qui manteniamo esplicito)
+                        out[term] = ""
+
+                    journal.write(orjson.dumps({term: out[term]}) + b"\n")
+                    journal.flush()
+
+                pbar.close()
+    finally:
+        # anche su eccezione / KeyboardInterrupt: le risposte già scaricate restano in cache
+        if cache is not None:
+            cache.close()
+
+    # salvataggio finale; il journal è ormai tutto in defs.json e va rimosso,
+    # altrimenti ogni run con --append ne accoderebbe un'altra copia
+    save_json(out, out_path)
+    jsonl_path.unlink(missing_ok=True)
     print(f"Fatto: {len(out)} voci totali, {updated} aggiornate.")
     return out
 
+def build_defs(words_path: Path, out_path: Path, append: bool = False,
+               concurrency: int = 16, cache_path: Optional[Path] = None) -> Dict[str, str]:
+    return asyncio.run(_build_defs_async(words_path, out_path, append=append,
+                                         concurrency=concurrency, cache_path=cache_path))
+
 # ---------- CLI ----------
 
+def positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"deve essere un intero >= 1, non {value}")
+    return n
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--input", required=True, help="Percorso a words.json (array di parole)")
     ap.add_argument("-o", "--output", default="defs.json", help="Percorso file output (mappa parola->definizione)")
     ap.add_argument("--append", action="store_true", help="Aggiorna defs.json senza sovrascrivere voci già presenti")
-    ap.add_argument("--save-every", type=int, default=50, help="Salva parziale ogni N parole (0 per disabilitare)")
+    ap.add_argument("--concurrency", type=positive_int, default=16, help="Numero massimo di parole elaborate in parallelo")
+    ap.add_argument("--cache", default="defs_cache.sqlite", help="File SQLite per la cache delle risposte HTTP ('' per disabilitare)")
     args = ap.parse_args()
 
     words_path = Path(args.input)
     out_path = Path(args.output)
+    cache_path = Path(args.cache) if args.cache else None
 
     try:
-        build_defs(words_path, out_path, append=args.append, save_every=args.save_every)
+        build_defs(words_path, out_path, append=args.append,
+                   concurrency=args.concurrency, cache_path=cache_path)
     except KeyboardInterrupt:
         print("\nInterrotto. Salvo lo stato parziale…")
-        # Non serve altro: build_defs fa salvataggi incrementali.
+        # Non serve altro: build_defs accoda ogni risultato a defs.jsonl (riprendi con --append).
         sys.exit(1)
 
 if __name__ == "__main__":